@@ -67,23 +67,14 @@ function readStdin() {
   });
 }
 
-async function main() {
-  const raw = await readStdin();
-  let req;
-  try {
-    req = JSON.parse(raw || '{}');
-  } catch {
-    process.stdout.write(
-      JSON.stringify({
-        passed: false,
-        exec_error: { type: 'JSONParseError', message: 'Invalid JSON', trace: '' },
-        stdout: '',
-        cases: [],
-      })
-    );
-    return;
-  }
-
+const INVALID_JSON = {
+  passed: false,
+  exec_error: { type: 'JSONParseError', message: 'Invalid JSON', trace: '' },
+  stdout: '',
+  cases: [],
+};
+
+function runRequest(req) {
   const code = req.code || '';
   const cases = req.cases || [];
   const timeoutMs = Math.max(250, Number(req.timeout_ms || 1500));
@@ -160,23 +151,82 @@ async function main() {
     }
   }
 
-  process.stdout.write(
-    JSON.stringify({
-      passed: Boolean(allPassed),
-      exec_error: execError,
-      stdout: logs.join('\n').slice(0, 4000),
-      cases: results,
-    })
-  );
+  return {
+    passed: Boolean(allPassed),
+    exec_error: execError,
+    stdout: logs.join('\n').slice(0, 4000),
+    cases: results,
+  };
+}
+
+function readInputFile() {
+  // One-shot input: an --input file (tmpfs, no pipe copy) or stdin.
+  const idx = process.argv.indexOf('--input');
+  if (idx === -1 || idx + 1 >= process.argv.length) return null;
+  try {
+    return require('node:fs').readFileSync(process.argv[idx + 1], 'utf8');
+  } catch {
+    return '';
+  }
 }
 
-main().catch((e) => {
-  process.stdout.write(
-    JSON.stringify({
-      passed: false,
-      exec_error: { type: e?.name || 'Error', message: String(e?.message || e), trace: String(e?.stack || '') },
-      stdout: '',
-      cases: [],
-    })
-  );
-});
+async function main() {
+  const raw = readInputFile() ?? (await readStdin());
+  let req;
+  try {
+    req = JSON.parse(raw || '{}');
+  } catch {
+    process.stdout.write(JSON.stringify(INVALID_JSON));
+    return;
+  }
+  process.stdout.write(JSON.stringify(runRequest(req)));
+}
+
+/**
+ * Persistent mode: length-prefixed JSON requests on stdin, length-prefixed
+ * responses on stdout. Every request gets a fresh vm context, same as the
+ * one-shot path — but a fresh context is NOT process isolation: node:vm is
+ * not a security boundary, and an escape from one request can mutate the
+ * host realm seen by every later request. The server therefore never pools
+ * this harness (see _run_harness in main.py); the one-shot path gives each
+ * submission its own process. Serve mode is kept only for the framing
+ * protocol's sake and must not be exposed to untrusted multi-user traffic.
+ */
+function serve() {
+  let buf = Buffer.alloc(0);
+  process.stdin.on('data', (chunk) => {
+    buf = Buffer.concat([buf, chunk]);
+    while (buf.length >= 4) {
+      const n = buf.readUInt32BE(0);
+      if (buf.length < 4 + n) break;
+      const payload = buf.subarray(4, 4 + n);
+      buf = buf.subarray(4 + n);
+      let out;
+      try {
+        out = runRequest(JSON.parse(payload.toString('utf8') || '{}'));
+      } catch {
+        out = INVALID_JSON;
+      }
+      const body = Buffer.from(JSON.stringify(out), 'utf8');
+      const head = Buffer.alloc(4);
+      head.writeUInt32BE(body.length, 0);
+      process.stdout.write(Buffer.concat([head, body]));
+    }
+  });
+  process.stdin.on('end', () => process.exit(0));
+}
+
+if (process.argv.includes('--serve')) {
+  serve();
+} else {
+  main().catch((e) => {
+    process.stdout.write(
+      JSON.stringify({
+        passed: false,
+        exec_error: { type: e?.name || 'Error', message: String(e?.message || e), trace: String(e?.stack || '') },
+        stdout: '',
+        cases: [],
+      })
+    );
+  });
+}
@@ -30,6 +30,7 @@ from __future__ import annotations
 
 import io
 import json
+import os
 import random
 import signal
 import sys
@@ -66,14 +67,7 @@ def _time_limit(timeout_s: float):
         signal.signal(signal.SIGALRM, old_handler)
 
 
-def main() -> int:
-    raw = sys.stdin.read()
-    try:
-        req = json.loads(raw or "{}")
-    except json.JSONDecodeError:
-        sys.stdout.write(json.dumps({"passed": False, "exec_error": {"type": "JSONDecodeError", "message": "Invalid JSON", "trace": ""}, "stdout": "", "cases": []}))
-        return 0
-
+def run_request(req: dict) -> dict:
     code = req.get("code") or ""
     cases = req.get("cases") or []
     max_stdout = int(req.get("max_stdout") or 4000)
@@ -144,15 +138,90 @@ def main() -> int:
                 }
             )
 
-    out = {
+    return {
         "passed": bool(all_passed),
         "exec_error": exec_error,
         "stdout": (stdout_buf.getvalue() or "")[:max_stdout],
         "cases": results,
     }
+
+
+def _decode_request(raw: bytes | str) -> dict | None:
+    try:
+        req = json.loads(raw or "{}")
+    except json.JSONDecodeError:
+        return None
+    return req if isinstance(req, dict) else None
+
+
+_INVALID_JSON = {"passed": False, "exec_error": {"type": "JSONDecodeError", "message": "Invalid JSON", "trace": ""}, "stdout": "", "cases": []}
+
+
+def _read_input() -> str:
+    """One-shot input: an --input file (tmpfs, no pipe copy) or stdin."""
+    argv = sys.argv[1:]
+    if "--input" in argv:
+        try:
+            with open(argv[argv.index("--input") + 1], "rb") as fh:
+                return fh.read().decode("utf-8", errors="replace")
+        except (IndexError, OSError):
+            return ""
+    return sys.stdin.read()
+
+
+def main() -> int:
+    req = _decode_request(_read_input())
+    out = _INVALID_JSON if req is None else run_request(req)
     sys.stdout.write(json.dumps(out, ensure_ascii=False))
     return 0
 
 
+def _read_exact(stream, n: int) -> bytes | None:
+    data = b""
+    while len(data) < n:
+        chunk = stream.read(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _write_frame(stream, out: dict) -> None:
+    buf = json.dumps(out, ensure_ascii=False).encode("utf-8")
+    stream.write(len(buf).to_bytes(4, "big") + buf)
+    stream.flush()
+
+
+def serve() -> int:
+    """Persistent mode: handle length-prefixed JSON requests from stdin.
+
+    Each request is executed in a forked child so untrusted code never
+    shares interpreter state with the serving loop or later submissions;
+    the child writes the length-prefixed response and exits.
+    """
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    can_fork = hasattr(os, "fork")
+    while True:
+        header = _read_exact(stdin, 4)
+        if header is None:
+            return 0
+        payload = _read_exact(stdin, int.from_bytes(header, "big"))
+        if payload is None:
+            return 0
+        req = _decode_request(payload.decode("utf-8", errors="replace"))
+        if req is None:
+            _write_frame(stdout, _INVALID_JSON)
+            continue
+        if can_fork:
+            pid = os.fork()
+            if pid == 0:
+                _write_frame(stdout, run_request(req))
+                os._exit(0)
+            os.waitpid(pid, 0)
+        else:
+            _write_frame(stdout, run_request(req))
+
+
 if __name__ == "__main__":
-    raise SystemExit(main())
+    raise SystemExit(serve() if "--serve" in sys.argv[1:] else main())